@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Compare the time taken to write and restore pcp checkpoints in the old
+gzipped SQL dump format and the snapshot + journal format.
+
+A FILECPY table of --rows rows is built in memory. A snapshot is taken, then
+--changed of the rows are updated and journalled, and finally the checkpoint
+is restored into a fresh database.
+
+    python bench/checkpoint.py --rows 10000000
+"""
+import argparse
+import gzip
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pcplib import checkpoint
+
+# Same schema as createDB() in pcp; keep the two in step. pcp cannot be
+# imported, as it starts a copy when it is loaded.
+SCHEMA = """
+CREATE TABLE FILECPY(
+ID INTEGER PRIMARY KEY AUTOINCREMENT,
+SORTORDER INTEGER DEFAULT -1,
+FILENAME TEXT,
+STATE INTEGER DEFAULT 0,
+SRCMD5 TEXT,
+SIZE INTEGER,
+CHUNKS INTEGER DEFAULT -1,
+ATTEMPTS INTEGER DEFAULT 0,
+LASTRANK INTEGER DEFAULT 0,
+JOB INTEGER DEFAULT 0,
+CHUNKBYTES INTEGER,
+SRCOSTS TEXT,
+DSTOSTS TEXT,
+DELTA INTEGER DEFAULT 0);
+CREATE TABLE ARGUMENTS(
+ID INTEGER PRIMARY KEY AUTOINCREMENT,
+ARGS BLOB);
+CREATE TABLE DIRS(
+ID INTEGER PRIMARY KEY,
+DEPTH INTEGER,
+JOB INTEGER,
+DIRNAME TEXT,
+MODE INTEGER,
+UID INTEGER,
+GID INTEGER,
+ATIME REAL,
+MTIME REAL);
+"""
+INDEXES = ("CREATE INDEX COPY_IDX ON FILECPY(STATE, SORTORDER, LASTRANK)",
+           "CREATE INDEX DIRS_IDX ON DIRS(DEPTH)")
+FILECOLUMNS = ("ID", "SORTORDER", "FILENAME", "STATE", "SRCMD5", "SIZE",
+               "CHUNKS", "ATTEMPTS", "LASTRANK", "JOB", "CHUNKBYTES",
+               "SRCOSTS", "DSTOSTS", "DELTA")
+DIRCOLUMNS = ("ID", "DEPTH", "JOB", "DIRNAME", "MODE", "UID", "GID", "ATIME",
+              "MTIME")
+TABLES = {"FILECPY": FILECOLUMNS, "ARGUMENTS": ("ID", "ARGS"),
+          "DIRS": DIRCOLUMNS}
+DIRECTORIES = 5000  # directories the files are spread over
+INSERTFILE = "INSERT OR REPLACE INTO FILECPY VALUES (%s)" \
+    % ",".join("?" * len(FILECOLUMNS))
+
+def newdb(index=True):
+    db = sqlite3.connect(":memory:")
+    db.text_factory = str
+    db.executescript(SCHEMA)
+    if index:
+        for sql in INDEXES:
+            db.execute(sql)
+    return(db)
+
+def populate(db, rows):
+    def generate():
+        for i in xrange(1, rows + 1):
+            yield (i, random.randint(0, rows),
+                   "/lustre/scratch/project/dir%04i/file%08i.dat"
+                   % (i % DIRECTORIES, i),
+                   2, "%032x" % random.getrandbits(128),
+                   random.randint(0, 1 << 30), -1, 0, 1 + i % 64, 0, None,
+                   "%i" % (i % 128), "%i" % ((i + 64) % 128), 0)
+    with db:
+        db.executemany(INSERTFILE, generate())
+        db.execute("INSERT INTO ARGUMENTS VALUES (1, ?)", ("args",))
+        db.executemany("INSERT INTO DIRS VALUES (?,?,?,?,?,?,?,?,?)",
+                       ((i + 1, 4, 0, "/lustre/scratch/project/dir%04i" % i,
+                         040755, 1000, 1000, 0.0, 0.0)
+                        for i in xrange(DIRECTORIES)))
+
+def timed(label, function, *args):
+    start = time.time()
+    result = function(*args)
+    elapsed = time.time() - start
+    print "%-40s %10.2f s" % (label, elapsed)
+    return(result)
+
+def legacydump(db, filename):
+    dbfile = gzip.open(filename, "wb")
+    for l in db.iterdump():
+        dbfile.write(l + "\n")
+    dbfile.close()
+
+def legacyrestore(filename):
+    db = sqlite3.connect(":memory:")
+    db.text_factory = str
+    dumpfile = gzip.open(filename, "rb")
+    db.executescript(dumpfile.read())
+    dumpfile.close()
+    return(db)
+
+def journal(db, filename, changed):
+    ckpt = checkpoint.Checkpointer(db, filename, TABLES)
+    ckpt.begin()
+    while ckpt.busy():
+        ckpt.step()
+    rows = db.execute("SELECT MAX(ID) FROM FILECPY").fetchone()[0]
+    ids = random.sample(xrange(1, rows + 1), int(rows * changed))
+    batch = []
+    for idx in ids:
+        batch.append((idx, 0, "changed", 4, None, 0, -1, 0, 0, 0, None,
+                      None, None, 0))
+        if len(batch) == 10000:
+            db.executemany(INSERTFILE, batch)
+            ckpt.record("FILECPY", batch)
+            batch = []
+    db.executemany(INSERTFILE, batch)
+    ckpt.record("FILECPY", batch)
+    ckpt.sync()
+
+def restore(filename):
+    # As restoreDB() in pcp: load, then index.
+    db = newdb(index=False)
+    checkpoint.restore(db, filename)
+    for sql in INDEXES:
+        db.execute(sql)
+    return(db)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--changed", type=float, default=0.1,
+                        help="fraction of rows changed after the snapshot")
+    parser.add_argument("--dir", default=tempfile.gettempdir(),
+                        help="directory to write checkpoints to")
+    parser.add_argument("--no-legacy", action="store_true",
+                        help="skip the (slow) gzipped SQL dump format")
+    args = parser.parse_args()
+
+    print "Building FILECPY with %i rows..." % args.rows
+    db = newdb()
+    populate(db, args.rows)
+
+    snapshot = os.path.join(args.dir, "pcpbench.checkpoint")
+    timed("snapshot write", checkpoint.dump, db, snapshot, TABLES)
+    print "%-40s %10.1f MB" % ("snapshot size",
+                               os.path.getsize(snapshot) / 1048576.0)
+    timed("fuzzy snapshot + journal of %.0f%% rows" % (args.changed * 100),
+          journal, db, snapshot, args.changed)
+    restored = timed("snapshot + journal restore", restore, snapshot)
+    assert restored.execute("SELECT COUNT(*) FROM FILECPY").fetchone()[0] \
+        == args.rows
+    del restored
+
+    if not args.no_legacy:
+        legacy = os.path.join(args.dir, "pcpbench.sql.gz")
+        timed("legacy gzip SQL dump", legacydump, db, legacy)
+        print "%-40s %10.1f MB" % ("legacy dump size",
+                                   os.path.getsize(legacy) / 1048576.0)
+        timed("legacy gzip SQL restore", legacyrestore, legacy)
+        os.remove(legacy)
+
+    header = checkpoint.readheader(snapshot)
+    os.remove(checkpoint.journalname(snapshot, header["generation"]))
+    os.remove(snapshot)
+
+if __name__ == "__main__":
+    main()
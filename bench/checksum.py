@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Compare the throughput of the checksum algorithms pcp can use with -ca.
+
+Each available algorithm hashes --size Mbytes of random data held in memory,
+--blksize bytes at a time, so the numbers are the single core ceiling for
+checksumming and do not include any IO. The time to combine the chunk
+digests of a file into a whole-file digest is also shown.
+
+    python bench/checksum.py --size 1024
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pcplib import checksum
+
+def throughput(algorithm, data, total):
+    h = checksum.new(algorithm)
+    done = 0
+    start = time.time()
+    while done < total:
+        h.update(data)
+        done += len(data)
+    h.hexdigest()
+    return(done / (time.time() - start))
+
+def treetime(algorithm, chunks):
+    h = checksum.new(algorithm)
+    h.update("chunk")
+    digests = [h.hexdigest()] * chunks
+    start = time.time()
+    checksum.treedigest(algorithm, 1048576, digests)
+    return(time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024,
+                        help="Mbytes to checksum with each algorithm")
+    parser.add_argument("--blksize", type=int, default=1048576,
+                        help="bytes passed to each update()")
+    parser.add_argument("--chunks", type=int, default=100000,
+                        help="chunk digests to combine into a tree digest")
+    args = parser.parse_args()
+
+    data = os.urandom(args.blksize)
+    total = args.size * 1048576
+    missing = [a for a in checksum.ALGORITHMS
+               if a not in checksum.available()]
+    if missing:
+        print "Not available here: %s" % ", ".join(missing)
+    print "%-10s %12s %18s" % ("algorithm", "Mbytes/s",
+                               "tree of %i (s)" % args.chunks)
+    for algorithm in checksum.available():
+        print "%-10s %12.1f %18.3f" \
+            % (algorithm, throughput(algorithm, data, total) / 1048576,
+               treetime(algorithm, args.chunks))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Run pcp on synthetic trees on this machine and record how fast it went.
+
+Trees are generated under --dir (use a tmpfs such as /dev/shm, or a local
+disk) and kept for later runs. The same --seed always gives the same tree.
+
+deep       files spread down a chain of --depth nested directories
+wide       files spread over --width directories side by side
+empty      empty files, 1000 to a directory
+heavytail  Pareto distributed file sizes, most small, a few very large
+sparse     a few --sparse-size files with only their ends written
+
+Each tree is copied with "mpirun -n --ranks pcp" --repeat times, and the best
+of each of these is kept:
+
+phase1_items_per_sec   the rate scantree reports for phase I
+phase2_bytes_per_sec   bytes copied / phase II time, from the -T telemetry
+phase2_files_per_sec   files copied / phase II time
+dispatches_per_sec     the rank 0 dispatch rate pcp reports
+checkpoint_dump_secs   writing the final checkpoint of the copy again
+checkpoint_restore_secs  loading that checkpoint into an empty database
+wall_secs              the whole mpirun
+
+The results go to --output as JSON; --compare shows the change between two
+results files, eg from before and after a commit.
+
+    python bench/pcpbench.py --dir /dev/shm --ranks 8 --output new.json
+    python bench/pcpbench.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shlex
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pcplib import checkpoint
+
+PCP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pcp")
+SHAPES = ("deep", "wide", "empty", "heavytail", "sparse")
+# Metrics where smaller is better; for the rest bigger is better.
+TIMES = ("checkpoint_dump_secs", "checkpoint_restore_secs", "wall_secs")
+
+def writefile(filename, size, block):
+    fh = open(filename, "wb")
+    try:
+        while size > 0:
+            fh.write(block[:size])
+            size -= len(block)
+    finally:
+        fh.close()
+
+def spread(root, directories, sizes, block):
+    """Write files of sizes round-robin into directories (relative to
+    root)."""
+    for d in directories:
+        os.makedirs(os.path.join(root, d))
+    for i, size in enumerate(sizes):
+        writefile(os.path.join(root, directories[i % len(directories)],
+                               "file%08i" % i), size, block)
+
+def generate(shape, root, args):
+    rng = random.Random(args.seed)
+    block = os.urandom(1048576)
+    if shape == "deep":
+        path = ""
+        directories = []
+        for i in range(args.depth):
+            path = os.path.join(path, "level%03i" % i)
+            directories.append(path)
+        spread(root, directories,
+               [rng.randint(0, 65536) for i in xrange(args.files)], block)
+    elif shape == "wide":
+        spread(root, ["dir%06i" % i for i in range(args.width)],
+               [rng.randint(0, 65536) for i in xrange(args.files)], block)
+    elif shape == "empty":
+        spread(root, ["dir%06i" % i
+                      for i in range(max(1, args.files // 1000))],
+               [0] * args.files, block)
+    elif shape == "heavytail":
+        sizes = [min(int(4096 * rng.paretovariate(1.2)), args.max_size)
+                 for i in xrange(args.files)]
+        spread(root, ["dir%04i" % i for i in range(max(1, args.files // 1000))],
+               sizes, block)
+    elif shape == "sparse":
+        os.makedirs(root)
+        for i in range(args.sparse_files):
+            fh = open(os.path.join(root, "sparse%03i" % i), "wb")
+            fh.write(block)
+            fh.seek(args.sparse_size - len(block))
+            fh.write(block)
+            fh.close()
+
+def tree(shape, args):
+    """Return the path of the tree for shape, generating it if need be."""
+    name = "pcpbench.%s.%i.%i" % (shape, args.files, args.seed)
+    if shape == "sparse":
+        name = "pcpbench.sparse.%i.%i" % (args.sparse_files, args.sparse_size)
+    root = os.path.join(args.dir, name)
+    # The marker lives outside the tree so that it is not copied.
+    if not os.path.exists(root + ".complete"):
+        print "Generating %s tree in %s..." % (shape, root)
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        generate(shape, root, args)
+        open(root + ".complete", "w").close()
+    return(root)
+
+def checkpointtimes(filename):
+    """Time restoring the checkpoint filename into an empty database, and
+    then dumping that database to a new checkpoint."""
+    tables = checkpoint.readheader(filename)["tables"]
+    db = sqlite3.connect(":memory:")
+    db.text_factory = str
+    for table, (columns, key) in tables.iteritems():
+        db.execute("CREATE TABLE %s (%s)" % (table, ", ".join(
+            c + (" INTEGER PRIMARY KEY" if c == key else "")
+            for c in columns)))
+    start = time.time()
+    checkpoint.restore(db, filename)
+    restored = time.time() - start
+    copy = filename + ".bench"
+    start = time.time()
+    checkpoint.dump(db, copy, dict((table, columns) for table, (columns, key)
+                                   in tables.iteritems()))
+    dumped = time.time() - start
+    header = checkpoint.readheader(copy)
+    os.remove(checkpoint.journalname(copy, header["generation"]))
+    os.remove(copy)
+    return(dumped, restored)
+
+def runpcp(source, args):
+    """Copy source with pcp once and return a dict of metrics."""
+    work = tempfile.mkdtemp(prefix="pcpbench.", dir=args.dir)
+    try:
+        dest = os.path.join(work, "dest")
+        progress = os.path.join(work, "progress.jsonl")
+        ckpt = os.path.join(work, "checkpoint")
+        command = (shlex.split(args.mpirun) + ["-n", str(args.ranks),
+                   sys.executable, PCP, "-T", progress, "-Ti", "86400",
+                   "-K", ckpt, "-Kx"] + shlex.split(args.pcp_args)
+                   + [source, dest])
+        start = time.time()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        wall = time.time() - start
+        if process.returncode != 0:
+            print output
+            raise RuntimeError("pcp failed: %s" % " ".join(command))
+
+        metrics = {"wall_secs": wall}
+        match = re.search(r"Phase I done: .*\(([\d.]+) items/sec\)", output)
+        if match:
+            metrics["phase1_items_per_sec"] = float(match.group(1))
+        match = re.search(r"Dispatched \d+ tasks in .*\(([\d.]+) dispatches/sec\)",
+                          output)
+        if match:
+            metrics["dispatches_per_sec"] = float(match.group(1))
+        record = json.loads(open(progress).readlines()[-1])
+        elapsed = max(record["elapsed_secs"], 1e-6)
+        ranks = record["ranks"].values()
+        metrics["phase2_bytes_per_sec"] = \
+            sum(r["bytes_copied"] for r in ranks) / elapsed
+        metrics["phase2_files_per_sec"] = \
+            sum(r["files_copied"] for r in ranks) / elapsed
+        metrics["checkpoint_dump_secs"], metrics["checkpoint_restore_secs"] = \
+            checkpointtimes(ckpt)
+        return(metrics)
+    finally:
+        shutil.rmtree(work)
+
+def best(runs):
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if metric in run]
+        if metric in TIMES:
+            result[metric] = min(values)
+        else:
+            result[metric] = max(values)
+    return(result)
+
+def commit():
+    try:
+        return(subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(PCP), stderr=open(os.devnull, "w")).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+
+def compare(oldfile, newfile):
+    old = json.load(open(oldfile))
+    new = json.load(open(newfile))
+    print "%-10s %-24s %14s %14s %8s" % ("tree", "metric", old["commit"],
+                                          new["commit"], "change")
+    for shape in sorted(set(old["results"]) & set(new["results"])):
+        for metric in sorted(new["results"][shape]):
+            before = old["results"][shape].get(metric)
+            after = new["results"][shape][metric]
+            if before is None:
+                continue
+            change = ""
+            if before:
+                change = "%+.1f%%" % (100.0 * (after - before) / before)
+            print "%-10s %-24s %14.2f %14.2f %8s" % (shape, metric, before,
+                                                      after, change)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", default=",".join(SHAPES),
+                        help="comma separated trees to run")
+    parser.add_argument("--files", type=int, default=100000,
+                        help="files in each tree (except sparse)")
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--max-size", type=int, default=256 << 20,
+                        help="largest file in the heavytail tree")
+    parser.add_argument("--sparse-files", type=int, default=4)
+    parser.add_argument("--sparse-size", type=int, default=4 << 30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ranks", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mpirun", default="mpirun",
+                        help="mpirun command, with any options it needs")
+    parser.add_argument("--pcp-args", default="",
+                        help="extra pcp options, eg \"-c -w 8\"")
+    parser.add_argument("--dir", default=tempfile.gettempdir(),
+                        help="directory for the trees and copies")
+    parser.add_argument("--output", default="pcpbench.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two --output files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    shapes = args.trees.split(",")
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error("unknown tree %s" % shape)
+
+    results = {}
+    for shape in shapes:
+        source = tree(shape, args)
+        runs = []
+        for i in range(args.repeat):
+            runs.append(runpcp(source, args))
+        results[shape] = best(runs)
+        for metric in sorted(results[shape]):
+            print "%-10s %-24s %14.2f" % (shape, metric, results[shape][metric])
+
+    output = {"commit": commit(), "time": time.time(),
+              "host": platform.node(), "ranks": args.ranks,
+              "pcp_args": args.pcp_args,
+              "trees": dict((k, v) for k, v in vars(args).iteritems()
+                            if k in ("files", "depth", "width", "max_size",
+                                     "sparse_files", "sparse_size", "seed")),
+              "results": results}
+    fh = open(args.output, "w")
+    json.dump(output, fh, indent=1, sort_keys=True)
+    fh.close()
+    print "Results written to %s" % args.output
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Merge the per-rank profiles written by pcp -P DIR into one report.
+
+Rank 0 runs the dispatcher and the other ranks do the copying, so the two
+are reported separately. For each, the span timings of the hot paths are
+summed over the ranks, followed by the merged cProfile statistics.
+
+    python bench/pcpprof.py /tmp/profile
+    python bench/pcpprof.py --sort tottime --limit 40 /tmp/profile
+"""
+import argparse
+import glob
+import json
+import os
+import pstats
+import re
+import sys
+
+def ranksof(directory, suffix):
+    """Return {rank: filename} for the pcp.<rank>.<suffix> files in
+    directory."""
+    files = {}
+    for filename in glob.glob(os.path.join(directory, "pcp.*.%s" % suffix)):
+        match = re.match(r"pcp\.(\d+)\.%s$" % suffix,
+                         os.path.basename(filename))
+        if match:
+            files[int(match.group(1))] = filename
+    return(files)
+
+def mergespans(filenames):
+    """Sum the spans in filenames. Returns {span: [calls, total secs,
+    longest call, ranks]}."""
+    merged = {}
+    for filename in filenames:
+        spans = json.load(open(filename))["spans"]
+        for name, (calls, total, longest) in spans.iteritems():
+            span = merged.setdefault(name, [0, 0.0, 0.0, 0])
+            span[0] += calls
+            span[1] += total
+            span[2] = max(span[2], longest)
+            span[3] += 1
+    return(merged)
+
+def printspans(spans):
+    print "%-64s %10s %10s %10s %10s %5s" % ("span", "calls", "total s",
+                                             "mean ms", "max ms", "ranks")
+    for name, (calls, total, longest, ranks) in sorted(
+            spans.iteritems(), key=lambda item: -item[1][1]):
+        print "%-64s %10i %10.3f %10.3f %10.3f %5i" \
+            % (name, calls, total, 1000 * total / max(calls, 1),
+               1000 * longest, ranks)
+
+def report(label, ranks, spanfiles, proffiles, args):
+    print "=" * 78
+    print "%s (%i ranks)" % (label, len(ranks))
+    print "=" * 78
+    spans = mergespans([spanfiles[r] for r in ranks if r in spanfiles])
+    if spans:
+        printspans(spans)
+        print
+    profiles = [proffiles[r] for r in ranks if r in proffiles]
+    if profiles and not args.spans_only:
+        stats = pstats.Stats(profiles[0])
+        for filename in profiles[1:]:
+            stats.add(filename)
+        stats.sort_stats(args.sort).print_stats(args.limit)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("DIR", help="directory given to pcp -P")
+    parser.add_argument("--sort", default="cumulative",
+                        help="pstats sort order (cumulative, tottime, calls...)")
+    parser.add_argument("--limit", type=int, default=30,
+                        help="functions to show from each merged profile")
+    parser.add_argument("--spans-only", action="store_true",
+                        help="only show the span timings")
+    args = parser.parse_args()
+
+    spanfiles = ranksof(args.DIR, "spans")
+    proffiles = ranksof(args.DIR, "prof")
+    ranks = sorted(set(spanfiles) | set(proffiles))
+    if not ranks:
+        print "No pcp profiles found in %s" % args.DIR
+        sys.exit(1)
+
+    if 0 in ranks:
+        report("Rank 0", [0], spanfiles, proffiles, args)
+    workers = [r for r in ranks if r != 0]
+    if workers:
+        report("Ranks %i-%i" % (workers[0], workers[-1]), workers, spanfiles,
+               proffiles, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Compare the rate at which directory entries can be listed with
+readdir.readdir() (one libc readdir call and one dirent object per entry),
+readdir.scandir() (batched getdents64, tuples) and os.listdir().
+
+A directory of --entries empty files is created under --dir unless it already
+exists, and listed --repeat times with each reader.
+
+    python bench/readdir.py --entries 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pcplib import readdir
+
+def populate(directory, entries):
+    os.mkdir(directory)
+    for i in xrange(entries):
+        os.close(os.open(os.path.join(directory, "file%08i" % i),
+                         os.O_CREAT | os.O_WRONLY, 0644))
+
+def legacy(directory):
+    return(sum(1 for entry in readdir.readdir(directory)
+               if entry.d_name not in (".", "..")))
+
+def batched(directory):
+    return(sum(1 for entry in readdir.scandir(directory)))
+
+def listdir(directory):
+    return(len(os.listdir(directory)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", default=tempfile.gettempdir(),
+                        help="directory to create the test directory in")
+    args = parser.parse_args()
+
+    directory = os.path.join(args.dir, "pcpbench.readdir.%i" % args.entries)
+    if not os.path.isdir(directory):
+        print "Creating %i files in %s..." % (args.entries, directory)
+        populate(directory, args.entries)
+
+    for label, function in (("readdir.readdir", legacy),
+                            ("readdir.scandir", batched),
+                            ("os.listdir", listdir)):
+        best = None
+        for i in range(args.repeat):
+            start = time.time()
+            count = function(directory)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        assert count == args.entries
+        print "%-20s %12.0f entries/s" % (label, count / best)
+    print "Test directory left in %s" % directory
+
+if __name__ == "__main__":
+    main()
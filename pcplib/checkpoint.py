@@ -0,0 +1,299 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Incremental checkpoints of an SQLite database.
+
+A checkpoint is a snapshot file plus a journal file. The snapshot holds the
+contents of a set of tables. The journal holds every row change made since
+the snapshot was started. Restoring loads the snapshot and then replays the
+journal on top of it.
+
+Each table must have an integer key column. Journal entries are whole-row
+upserts and deletes by key, so replaying a change that the snapshot already
+contains does no harm. The snapshot can therefore be read a slice at a time
+while the database is still being modified; it does not need to be a
+consistent picture of any single moment.
+
+Both files are a sequence of blocks: a 4 byte length, then a zlib compressed
+marshal of the block contents. The first block of each file is a header
+dict. A truncated final block (eg from a crash mid-write) is ignored.
+
+All file IO happens on a background thread, so the caller never waits for
+the disk unless it asks to with sync().
+
+    ckpt = Checkpointer(db, "/path/to/checkpoint",
+                        {"FILECPY": ("ID", "FILENAME", "STATE")})
+    ckpt.begin()                 # start a new snapshot
+    while ckpt.busy():
+        ckpt.step()              # read the next slice of the snapshot
+    ckpt.record("FILECPY", upserts=[(1, "foo", 2)], deletes=[3])
+    ckpt.commit()                # fsync the journal
+    ckpt.sync()                  # wait until everything is on disk
+"""
+import marshal
+import os
+import Queue
+import struct
+import threading
+import zlib
+
+MAGIC = "PCPCHECKPOINT\n"
+VERSION = 1
+_LENGTH = struct.Struct("!I")
+
+def journalname(filename, generation):
+    """Name of the journal which goes with generation of snapshot filename."""
+    return("%s.journal-%s" % (filename, generation))
+
+def ischeckpoint(filename):
+    """Return True if filename is a checkpoint written by this module."""
+    fh = open(filename, "rb")
+    magic = fh.read(len(MAGIC))
+    fh.close()
+    return(magic == MAGIC)
+
+def _newgeneration():
+    return(os.urandom(8).encode("hex"))
+
+class _BlockFile():
+    """A file of length-prefixed, compressed marshal blocks."""
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.fh = open(filename, "wb")
+        self.fh.write(MAGIC)
+        self.size = 0
+        self.write(header)
+
+    def write(self, block):
+        data = zlib.compress(marshal.dumps(block), 1)
+        self.fh.write(_LENGTH.pack(len(data)))
+        self.fh.write(data)
+        self.size += len(data)
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def close(self):
+        self.sync()
+        self.fh.close()
+
+def _readblocks(filename):
+    """Generator returning the blocks in filename, header first. Stops at the
+    first incomplete block."""
+    fh = open(filename, "rb")
+    try:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise IOError("%s is not a checkpoint file" % filename)
+        while True:
+            length = fh.read(_LENGTH.size)
+            if len(length) < _LENGTH.size:
+                return
+            length = _LENGTH.unpack(length)[0]
+            data = fh.read(length)
+            if len(data) < length:
+                return
+            try:
+                yield marshal.loads(zlib.decompress(data))
+            except (zlib.error, ValueError, EOFError):
+                return
+    finally:
+        fh.close()
+
+def _insertsql(table, columns, replace=True):
+    return("INSERT %sINTO %s (%s) VALUES (%s)"
+           % (replace and "OR REPLACE " or "", table, ", ".join(columns),
+              ", ".join("?" * len(columns))))
+
+def readheader(filename):
+    """Return the header dict of the checkpoint filename."""
+    for header in _readblocks(filename):
+        return(header)
+    raise IOError("%s is truncated" % filename)
+
+def restore(db, filename):
+    """Load the checkpoint filename into db. The tables must already exist
+    and be empty; any columns the checkpoint does not know about get their
+    defaults. Loading is quicker if indexes are created afterwards."""
+    blocks = _readblocks(filename)
+    header = blocks.next()
+    tables = header["tables"]
+    with db:
+        for table, rows in blocks:
+            db.executemany(_insertsql(table, tables[table][0], False), rows)
+
+    journal = journalname(filename, header["generation"])
+    if not os.path.exists(journal):
+        return
+    blocks = _readblocks(journal)
+    if blocks.next()["generation"] != header["generation"]:
+        return
+    with db:
+        for table, upserts, deletes in blocks:
+            columns, key = tables[table]
+            if upserts:
+                db.executemany(_insertsql(table, columns), upserts)
+            if deletes:
+                db.executemany("DELETE FROM %s WHERE %s = ?" % (table, key),
+                               [(k,) for k in deletes])
+
+class Checkpointer():
+    """Maintain an incremental checkpoint of db in filename.
+
+    tables is a dict mapping table name to a tuple of column names. The
+    first column is the integer key."""
+    SLICEROWS = 10000
+
+    def __init__(self, db, filename, tables):
+        self.db = db
+        self.filename = filename
+        self.tables = dict((name, (columns, columns[0]))
+                           for name, columns in tables.items())
+        # The journal of the last complete snapshot, and the snapshot being
+        # built along with its journal. These belong to the writer thread.
+        self.journal = None
+        self.snapshot = None
+        self.newjournal = None
+        # Tables still to be read into the snapshot being built, and the
+        # last key read from the first of them.
+        self.pending = []
+        self.generation = None
+        self.error = None
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _writer(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if self.error is None:
+                    job[0](*job[1:])
+            except Exception as error:
+                self.error = error
+            self.queue.task_done()
+
+    def _submit(self, *job):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        self.queue.put(job)
+
+    def busy(self):
+        """True while a snapshot is being read from db."""
+        return(len(self.pending) > 0)
+
+    def begin(self):
+        """Start a new snapshot. Call step() until busy() returns False to
+        complete it; until then the previous checkpoint stays valid."""
+        if self.busy():
+            return
+        # A checkpoint we did not write ourselves may already be there (eg
+        # the one we were restored from); its journal needs tidying up once
+        # our snapshot replaces it.
+        stale = None
+        if self.generation is None and os.path.exists(self.filename):
+            try:
+                stale = journalname(self.filename,
+                                    readheader(self.filename)["generation"])
+            except (IOError, KeyError, TypeError, StopIteration):
+                pass
+        self.generation = _newgeneration()
+        header = {"version": VERSION, "generation": self.generation,
+                  "tables": self.tables}
+        # Read the tables in order of name, then key.
+        self.pending = [[table, None] for table in sorted(self.tables)]
+        self._submit(self._open, self.filename + "__PARTIAL__",
+                     journalname(self.filename, self.generation), header,
+                     stale)
+
+    def _open(self, snapshotname, journalname, header, stale):
+        self.snapshot = _BlockFile(snapshotname, header)
+        self.newjournal = _BlockFile(journalname,
+                                     {"generation": header["generation"]})
+        self.stale = stale
+
+    def step(self, rows=None):
+        """Read the next slice of the snapshot from db."""
+        if not self.busy():
+            return
+        rows = rows or self.SLICEROWS
+        table, lastkey = self.pending[0]
+        columns, key = self.tables[table]
+        if lastkey is None:
+            query = ("SELECT %s FROM %s ORDER BY %s LIMIT ?"
+                     % (", ".join(columns), table, key))
+            data = self.db.execute(query, (rows,)).fetchall()
+        else:
+            query = ("SELECT %s FROM %s WHERE %s > ? ORDER BY %s LIMIT ?"
+                     % (", ".join(columns), table, key, key))
+            data = self.db.execute(query, (lastkey, rows)).fetchall()
+        if data:
+            self._submit(self._writesnapshot, table, data)
+            self.pending[0][1] = data[-1][0]
+        if len(data) < rows:
+            self.pending.pop(0)
+            if not self.pending:
+                self._submit(self._finish)
+
+    def _writesnapshot(self, table, data):
+        self.snapshot.write((table, data))
+
+    def _finish(self):
+        # Make the new snapshot and its journal the current checkpoint, and
+        # retire the old journal.
+        self.newjournal.sync()
+        self.snapshot.close()
+        os.rename(self.snapshot.filename, self.filename)
+        if self.journal:
+            self.journal.close()
+            os.remove(self.journal.filename)
+        elif self.stale and os.path.exists(self.stale):
+            os.remove(self.stale)
+        self.journal = self.newjournal
+        self.snapshot = self.newjournal = None
+
+    def record(self, table, upserts=(), deletes=()):
+        """Journal changes to table. upserts are whole rows in column order,
+        deletes are keys."""
+        if upserts or deletes:
+            self._submit(self._writejournal, (table, list(upserts),
+                                              list(deletes)))
+
+    def _writejournal(self, block):
+        for journal in (self.journal, self.newjournal):
+            if journal:
+                journal.write(block)
+
+    def commit(self):
+        """Make the journalled changes durable, in the background. Starts a
+        new snapshot if the journal has grown larger than the snapshot."""
+        self._submit(self._commit)
+        if (self.journal and not self.busy() and
+            self.journal.size > os.path.getsize(self.filename)):
+            self.begin()
+
+    def _commit(self):
+        for journal in (self.journal, self.newjournal):
+            if journal:
+                journal.sync()
+
+    def sync(self):
+        """Complete any snapshot in progress and wait for everything to be
+        written to disk."""
+        while self.busy():
+            self.step(self.SLICEROWS * 10)
+        self._submit(self._commit)
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+def dump(db, filename, tables):
+    """Write a complete checkpoint of db to filename and wait for it to
+    finish."""
+    ckpt = Checkpointer(db, filename, tables)
+    ckpt.begin()
+    ckpt.sync()
@@ -0,0 +1,134 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Checksum algorithms for pcp.
+
+All algorithms look like hashlib objects (update() and hexdigest()). The
+cryptographic hashes come from hashlib; the fast non-cryptographic ones need
+optional modules and are only listed in available() if they can be imported.
+
+md5       hashlib
+sha1      hashlib
+sha256    hashlib
+blake2b   hashlib (python 3.6+) or the pyblake2 module
+crc32     zlib
+crc32c    the crc32c module
+xxh64     the xxhash module
+
+A file which is copied in chunks has a digest for each chunk. treedigest()
+combines those into a single digest for the whole file: the hash of the
+chunk size, the number of chunks and the chunk digests in order. It can be
+calculated without reading the file again, and filedigest() calculates the
+same value from the file itself.
+
+    h = new("sha256")
+    h.update(data)
+    h.hexdigest()
+    treedigest("sha256", 1048576, [chunk0digest, chunk1digest])
+"""
+import hashlib
+import struct
+import zlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+if hasattr(hashlib, "blake2b"):
+    _blake2b = hashlib.blake2b
+else:
+    try:
+        import pyblake2
+        _blake2b = pyblake2.blake2b
+    except ImportError:
+        _blake2b = None
+
+class _CRC():
+    """hashlib style wrapper around a crc32 function."""
+    def __init__(self, function):
+        self.function = function
+        self.crc = 0
+
+    def update(self, data):
+        self.crc = self.function(data, self.crc)
+
+    def digest(self):
+        return(struct.pack("!I", self.crc & 0xffffffff))
+
+    def hexdigest(self):
+        return("%08x" % (self.crc & 0xffffffff))
+
+def _crc32c(data, crc):
+    return(crc32c.crc32(data, crc))
+
+_ALGORITHMS = {
+    "md5": lambda: hashlib.md5(),
+    "sha1": lambda: hashlib.sha1(),
+    "sha256": lambda: hashlib.sha256(),
+    "crc32": lambda: _CRC(zlib.crc32),
+}
+if _blake2b:
+    _ALGORITHMS["blake2b"] = lambda: _blake2b()
+if crc32c:
+    _ALGORITHMS["crc32c"] = lambda: _CRC(_crc32c)
+if xxhash:
+    _ALGORITHMS["xxh64"] = lambda: xxhash.xxh64()
+
+ALGORITHMS = ("md5", "sha1", "sha256", "blake2b", "crc32", "crc32c", "xxh64")
+
+def available():
+    """The algorithms which can be used on this machine."""
+    return([name for name in ALGORITHMS if name in _ALGORITHMS])
+
+def new(algorithm):
+    """Return a new hash object for algorithm. Raises ValueError if the
+    algorithm is not available."""
+    try:
+        return(_ALGORITHMS[algorithm]())
+    except KeyError:
+        raise ValueError("checksum algorithm %s is not available" % algorithm)
+
+def treedigest(algorithm, chunksize, digests):
+    """Combine the hex digests of the consecutive chunksize chunks of a file
+    into a digest of the whole file."""
+    h = new(algorithm)
+    h.update("pcp-tree:%i:%i:" % (chunksize, len(digests)))
+    for digest in digests:
+        h.update(digest.decode("hex"))
+    return(h.hexdigest())
+
+def filedigest(filename, algorithm, chunksize=None, blksize=1048576):
+    """Calculate the digest of filename. If chunksize is given, return the
+    treedigest() of its chunks as pcp would for a file copied in chunks."""
+    digests = []
+    fh = open(filename, "rb")
+    try:
+        while True:
+            h = new(algorithm)
+            done = 0
+            while chunksize is None or done < chunksize:
+                if chunksize is None:
+                    data = fh.read(blksize)
+                else:
+                    data = fh.read(min(blksize, chunksize - done))
+                if not data:
+                    break
+                h.update(data)
+                done += len(data)
+            if chunksize is None:
+                return(h.hexdigest())
+            if done == 0 and digests:
+                break
+            digests.append(h.hexdigest())
+            if done < chunksize:
+                break
+    finally:
+        fh.close()
+    return(treedigest(algorithm, chunksize, digests))
@@ -0,0 +1,189 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+This module copies byte ranges between open files, preferably without the
+data passing through python.
+
+The engines are tried in this order:
+
+copy_file_range  copy_file_range(2); in-kernel, may be offloaded to the
+                 filesystem.
+sendfile         sendfile(2); in-kernel page cache to page cache copy.
+splice           splice(2) via a pipe.
+python           os.read / os.write loop.
+
+Not every kernel or filesystem supports every engine. The engine which works
+is remembered for each (source, destination) filesystem pair, so only the
+first copy between two filesystems pays for probing.
+
+    selector = EngineSelector()
+    copied, engine = selector.copy(infd, outfd, offset, length, blksize)
+"""
+import ctypes
+import errno
+import os
+import platform
+
+_clib = ctypes.CDLL("libc.so.6", use_errno=True)
+_loff_t = ctypes.c_int64
+_loff_p = ctypes.POINTER(_loff_t)
+
+ENGINES = ("copy_file_range", "sendfile", "splice", "python")
+
+# errnos which mean "this engine cannot be used for these files", rather than
+# a real IO error.
+_UNSUPPORTED = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.ENOTSUP, errno.EBADF, errno.ESPIPE])
+
+# Largest amount to ask the kernel to move in one call.
+_MAXCALL = 1 << 30
+
+# copy_file_range arrived in glibc 2.27; older glibc on a newer kernel can
+# still use the raw system call.
+_SYSCALLS = {"x86_64": 326, "aarch64": 285, "ppc64le": 379, "ppc64": 379}
+if hasattr(_clib, "copy_file_range"):
+    _copy_file_range = _clib.copy_file_range
+    _copy_file_range.argtypes = [ctypes.c_int, _loff_p, ctypes.c_int, _loff_p,
+                                 ctypes.c_size_t, ctypes.c_uint]
+elif platform.machine() in _SYSCALLS:
+    _nr = _SYSCALLS[platform.machine()]
+    def _copy_file_range(infd, inoff, outfd, outoff, count, flags):
+        return(_clib.syscall(_nr, infd, inoff, outfd, outoff,
+                             ctypes.c_size_t(count), ctypes.c_uint(flags)))
+else:
+    _copy_file_range = None
+
+if hasattr(_clib, "sendfile64"):
+    _sendfile = _clib.sendfile64
+else:
+    _sendfile = _clib.sendfile
+_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, _loff_p, ctypes.c_size_t]
+_sendfile.restype = ctypes.c_ssize_t
+
+_splice = getattr(_clib, "splice", None)
+if _splice:
+    _splice.argtypes = [ctypes.c_int, _loff_p, ctypes.c_int, _loff_p,
+                        ctypes.c_size_t, ctypes.c_uint]
+    _splice.restype = ctypes.c_ssize_t
+SPLICE_F_MOVE = 1
+
+class UnsupportedEngine(Exception):
+    """The engine cannot copy between these two files."""
+    pass
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            return(None)
+        if err in _UNSUPPORTED:
+            raise UnsupportedEngine(err)
+        raise OSError(err, os.strerror(err))
+    return(result)
+
+def _copyfilerange(infd, outfd, offset, count, blksize):
+    if _copy_file_range is None:
+        raise UnsupportedEngine(errno.ENOSYS)
+    inoff = _loff_t(offset)
+    outoff = _loff_t(offset)
+    while True:
+        n = _check(_copy_file_range(infd, ctypes.byref(inoff), outfd,
+                                    ctypes.byref(outoff), count, 0))
+        if n is not None:
+            return(n)
+
+def _sendfile64(infd, outfd, offset, count, blksize):
+    inoff = _loff_t(offset)
+    os.lseek(outfd, offset, os.SEEK_SET)
+    while True:
+        n = _check(_sendfile(outfd, infd, ctypes.byref(inoff), count))
+        if n is not None:
+            return(n)
+
+def _splicecopy(infd, outfd, offset, count, blksize):
+    if _splice is None:
+        raise UnsupportedEngine(errno.ENOSYS)
+    pipeout, pipein = os.pipe()
+    try:
+        inoff = _loff_t(offset)
+        outoff = _loff_t(offset)
+        # A pipe holds 64k by default.
+        count = min(count, 65536)
+        while True:
+            n = _check(_splice(infd, ctypes.byref(inoff), pipein, None, count,
+                               SPLICE_F_MOVE))
+            if n is not None:
+                break
+        done = 0
+        while done < n:
+            m = _check(_splice(pipeout, None, outfd, ctypes.byref(outoff),
+                               n - done, SPLICE_F_MOVE))
+            if m:
+                done += m
+        return(n)
+    finally:
+        os.close(pipeout)
+        os.close(pipein)
+
+def _pythoncopy(infd, outfd, offset, count, blksize):
+    os.lseek(infd, offset, os.SEEK_SET)
+    data = os.read(infd, min(count, blksize))
+    os.lseek(outfd, offset, os.SEEK_SET)
+    done = 0
+    while done < len(data):
+        done += os.write(outfd, data[done:])
+    return(len(data))
+
+_FUNCTIONS = {"copy_file_range": _copyfilerange,
+              "sendfile": _sendfile64,
+              "splice": _splicecopy,
+              "python": _pythoncopy}
+
+class EngineSelector():
+    """Choose a copy engine for each pair of filesystems.
+
+    engine is one of ENGINES, or "auto" to try them all in order. If the
+    chosen engine does not work the python engine is used instead."""
+    def __init__(self, engine="auto"):
+        if engine == "auto":
+            self.candidates = ENGINES
+        else:
+            self.candidates = (engine, "python")
+        self.chosen = {}
+
+    def copy(self, infd, outfd, offset=0, length=None, blksize=1048576):
+        """Copy length bytes from infd to outfd starting at offset in both.
+        If length is None copy until the end of infd. Returns a tuple of
+        (bytes copied, engine name)."""
+        instat = os.fstat(infd)
+        key = (instat.st_dev, os.fstat(outfd).st_dev)
+        if key not in self.chosen:
+            self.chosen[key] = list(self.candidates)
+        engines = self.chosen[key]
+
+        copied = 0
+        while length is None or copied < length:
+            if length is None:
+                count = _MAXCALL
+            else:
+                count = min(length - copied, _MAXCALL)
+            try:
+                n = _FUNCTIONS[engines[0]](infd, outfd, offset + copied,
+                                           count, blksize)
+            except UnsupportedEngine:
+                if engines[0] == "python":
+                    raise
+                engines.pop(0)
+                continue
+            # Some filesystems report EOF to in-kernel copies of files which
+            # do have data (eg procfs, some network filesystems). If
+            # we see EOF before the end of the file, drop the engine.
+            if (n == 0 and engines[0] != "python" and
+                offset + copied < instat.st_size):
+                engines.pop(0)
+                continue
+            if n == 0:
+                break
+            copied += n
+        return(copied, engines[0])
@@ -0,0 +1,91 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Direct I/O (O_DIRECT), bypassing the page cache.
+
+Data read or written through the page cache evicts other jobs' data from the
+nodes pcp runs on, and posix_fadvise(POSIX_FADV_DONTNEED) is only advice. A
+file descriptor with O_DIRECT set moves data straight between the device
+and pcp's buffers instead. The buffers, the file offset and the length of
+each read or write must all be multiples of ALIGN.
+
+Not every filesystem supports O_DIRECT. Opener.open() opens files as usual
+and then turns O_DIRECT on, which the kernel refuses on filesystems that
+cannot do it. The answer is remembered for each filesystem, and the first
+file read on each one is also test read, as some accept the flag but fail
+the I/O. buffered() turns O_DIRECT off again, for the pieces of a file
+(usually its unaligned tail) which cannot be done directly.
+
+    opener = Opener()
+    fd = opener.open(path, os.O_RDONLY)
+    buf = alignedbuffer(4194304)
+    if isdirect(fd) and length % ALIGN:
+        buffered(fd)
+"""
+import ctypes
+import errno
+import fcntl
+import io
+import mmap
+import os
+
+O_DIRECT = getattr(os, "O_DIRECT", 040000)
+O_ACCMODE = 3
+ALIGN = mmap.PAGESIZE
+
+def alignedbuffer(size):
+    """Return a writable buffer of size bytes, aligned for direct I/O."""
+    return((ctypes.c_char * size).from_buffer(mmap.mmap(-1, size)))
+
+def roundup(n):
+    """n rounded up to a multiple of ALIGN."""
+    return(-(-n // ALIGN) * ALIGN)
+
+def isdirect(fd):
+    return(bool(fcntl.fcntl(fd, fcntl.F_GETFL) & O_DIRECT))
+
+def direct(fd):
+    """Turn O_DIRECT on for fd. Raises IOError EINVAL if the filesystem
+    does not support it."""
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | O_DIRECT)
+
+def buffered(fd):
+    """Turn O_DIRECT off for fd."""
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~O_DIRECT)
+
+class Opener():
+    """Open files with O_DIRECT on the filesystems which allow it."""
+    def __init__(self):
+        self.capable = {}  # st_dev: whether O_DIRECT works there
+        self.refused = []  # (filename, reason) for each filesystem refusing
+
+    def open(self, filename, flags, mode=0666):
+        """os.open filename, with O_DIRECT set if its filesystem allows."""
+        fd = os.open(filename, flags, mode)
+        try:
+            dev = os.fstat(fd).st_dev
+            if self.capable.get(dev, True):
+                try:
+                    direct(fd)
+                    if dev not in self.capable:
+                        self._probe(fd, flags)
+                    self.capable[dev] = True
+                except (IOError, OSError), error:
+                    if error.errno != errno.EINVAL:
+                        raise
+                    buffered(fd)
+                    self.capable[dev] = False
+                    self.refused.append((filename, os.strerror(error.errno)))
+        except:
+            os.close(fd)
+            raise
+        return(fd)
+
+    def _probe(self, fd, flags):
+        """Read the first block of fd directly, if it is open for reading."""
+        if flags & O_ACCMODE == os.O_WRONLY:
+            return
+        buf = alignedbuffer(ALIGN)
+        io.FileIO(fd, "r", closefd=False).readinto(memoryview(buf))
+        os.lseek(fd, 0, os.SEEK_SET)
@@ -0,0 +1,60 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Per-directory lstat indexes, for incremental copies.
+
+index() lists a directory once and lstats its entries, returning a dict of
+name: lstat result. A name which is not in the dict does not exist, so
+finding that out costs no lstat at all. The lstats are done in readdir order
+by a pool of threads, so several are in flight at once rather than one at a
+time as each file is reached. Filesystems which prefetch attributes for a
+readdir followed by stats in the same order, such as lustre with statahead,
+also see the pattern they look for.
+
+An entry which could not be stat'ed is None in the index, and a directory
+which could not be listed has no index at all; the caller should lstat the
+file itself in either case.
+
+    entries = dirindex.index("/backup/yesterday/dir", pool)
+    if entries is None or entries.get(name, False) is None:
+        st = safestat.safestat(os.path.join(directory, name))
+    elif name in entries:
+        st = entries[name]
+"""
+import errno
+import os
+
+import readdir
+import safestat
+
+def _lstat(path):
+    try:
+        return(safestat.safestat(path))
+    except OSError, error:
+        if error.errno == errno.ENOENT:
+            # Gone since we listed the directory.
+            return(False)
+        return(None)
+
+def index(directory, pool=None, names=None):
+    """Return a dict of name: lstat result for the entries in directory, or
+    None if it cannot be listed. A directory which does not exist has no
+    entries. If names is given, only those names are looked at, and the
+    index says nothing about any others. The lstats are run on pool (a
+    multiprocessing.pool.ThreadPool) if there is one."""
+    try:
+        listing = [name for name, d_type, inode in readdir.scandir(directory)]
+    except OSError, error:
+        if error.errno in (errno.ENOENT, errno.ENOTDIR):
+            return({})
+        return(None)
+    if names is not None:
+        listing = [name for name in listing if name in names]
+    paths = [os.path.join(directory, name) for name in listing]
+    if pool is not None and len(paths) > 1:
+        stats = pool.map(_lstat, paths)
+    else:
+        stats = map(_lstat, paths)
+    return(dict((name, st) for name, st in zip(listing, stats)
+                if st is not False))
@@ -0,0 +1,310 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Overlapped read / hash / write of file data.
+
+An IOPipeline has a reader thread, a writer thread and a fixed pool of
+preallocated buffers. While the caller hashes block N, the reader is filling
+block N+1 and the writer is writing out block N-1. The reads, writes and
+hashlib updates all release the GIL, so the three stages really do run at
+the same time. Blocks are read straight into the pool buffers with readinto,
+so no new strings are allocated per block.
+
+Data which fits in a single buffer is handled in the calling thread; handing
+it between threads would cost more than it saves.
+
+With direct=True the buffers are aligned for direct I/O, and file
+descriptors with O_DIRECT set are read and written directly wherever the
+offset and length allow. The pieces which cannot be, such as the unaligned
+tail of a file, are done through the page cache instead, and counted in
+fellback.
+
+    pipeline = IOPipeline(depth=4, bufsize=4194304)
+    copied = pipeline.run(infd, outfd, offset, length, hashlib.md5())
+    checked = pipeline.run(infd, None, offset, length, hashlib.md5())
+
+update() and zero() bring an existing file in line with another in place,
+writing only the blocks which differ. They run in the calling thread.
+
+    compared, rewritten = pipeline.update(infd, outfd, offset, length)
+"""
+import ctypes
+import errno
+import io
+import os
+import Queue
+import threading
+
+import directio
+
+class IOPipeline():
+    """Copy and/or hash byte ranges between file descriptors through depth
+    buffers of bufsize bytes."""
+    def __init__(self, depth=4, bufsize=4194304, direct=False):
+        self.depth = max(2, depth)
+        self.direct = direct
+        self.free = Queue.Queue()
+        if direct:
+            bufsize = directio.roundup(bufsize)
+        self.bufsize = bufsize
+        for i in range(self.depth):
+            if direct:
+                self.free.put(directio.alignedbuffer(bufsize))
+            else:
+                self.free.put(bytearray(bufsize))
+        self.directfds = set()  # fds being read or written directly
+        self.degraded = set()   # ... and those which had to stop
+        # Bytes read and written through the page cache on file descriptors
+        # which had O_DIRECT set.
+        self.fellback = [0, 0]
+        self.readjobs = Queue.Queue()
+        self.filled = Queue.Queue()
+        self.writejobs = Queue.Queue()
+        self.written = Queue.Queue()
+        self.abort = False
+        for target in (self._reader, self._writer):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _reader(self):
+        while True:
+            infd, offset, length = self.readjobs.get()
+            error = None
+            try:
+                infile = io.FileIO(infd, "r", closefd=False)
+                infile.seek(offset)
+                done = 0
+                while length is None or done < length:
+                    buf = self.free.get()
+                    if self.abort:
+                        self.free.put(buf)
+                        break
+                    want = self.bufsize
+                    if length is not None:
+                        want = min(want, length - done)
+                    try:
+                        n = self._readinto(infile, buf, want)
+                    except:
+                        # Or the pool runs dry after depth failed reads.
+                        self.free.put(buf)
+                        raise
+                    if not n:
+                        self.free.put(buf)
+                        break
+                    done += n
+                    self.filled.put((buf, n))
+            except Exception as err:
+                error = err
+            # End of job marker.
+            self.filled.put((None, error))
+
+    def _writer(self):
+        error = None
+        while True:
+            job = self.writejobs.get()
+            if job is None:
+                # End of job; report how it went.
+                self.written.put(error)
+                error = None
+                continue
+            outfd, buf, n = job
+            try:
+                if error is None:
+                    self._write(outfd, buf, n)
+            except Exception as err:
+                error = err
+                self.abort = True
+            self.free.put(buf)
+
+    def run(self, infd, outfd, offset=0, length=None, hashobj=None):
+        """Read length bytes (or to the end of the file if length is None)
+        from infd starting at offset. Write them to outfd at the same offset
+        unless outfd is None, and feed them to hashobj unless it is None.
+        Returns the number of bytes read."""
+        if outfd is not None:
+            os.lseek(outfd, offset, os.SEEK_SET)
+        self._start(infd, outfd, offset)
+        if length is None:
+            remaining = os.fstat(infd).st_size - offset
+        else:
+            remaining = length
+        if remaining < self.bufsize:
+            return(self._runsmall(infd, outfd, offset, length, hashobj))
+
+        self.abort = False
+        self.readjobs.put((infd, offset, length))
+        copied = 0
+        error = None
+        while True:
+            buf, n = self.filled.get()
+            if buf is None:
+                error = n
+                break
+            if hashobj is not None and not self.abort:
+                hashobj.update(buffer(buf, 0, n))
+            copied += n
+            if outfd is None:
+                self.free.put(buf)
+            else:
+                self.writejobs.put((outfd, buf, n))
+        if outfd is not None:
+            self.writejobs.put(None)
+            error = error or self.written.get()
+        if error is not None:
+            raise error
+        return(copied)
+
+    def _runsmall(self, infd, outfd, offset, length, hashobj):
+        buf = self.free.get()
+        try:
+            os.lseek(infd, offset, os.SEEK_SET)
+            infile = io.FileIO(infd, "r", closefd=False)
+            copied = 0
+            # Loop in case the file has grown since we looked at it.
+            while length is None or copied < length:
+                want = self.bufsize
+                if length is not None:
+                    want = min(want, length - copied)
+                n = self._readinto(infile, buf, want)
+                if not n:
+                    break
+                if hashobj is not None:
+                    hashobj.update(buffer(buf, 0, n))
+                if outfd is not None:
+                    self._write(outfd, buf, n)
+                copied += n
+            return(copied)
+        finally:
+            self.free.put(buf)
+
+    def update(self, infd, outfd, offset=0, length=None, hashobj=None,
+               block=1048576):
+        """Make outfd the same as infd from offset for length bytes (or to
+        the end of infd if length is None). outfd must be open for reading
+        and writing. Both are read a buffer at a time and compared in pieces
+        of block bytes; only the pieces of outfd which differ are written.
+        The data of infd is fed to hashobj unless it is None. Returns (bytes
+        compared, bytes rewritten)."""
+        self._start(infd, outfd, offset)
+        new = self.free.get()
+        old = self.free.get()
+        try:
+            infile = io.FileIO(infd, "r", closefd=False)
+            infile.seek(offset)
+            outfile = io.FileIO(outfd, "r", closefd=False)
+            compared = 0
+            rewritten = 0
+            while length is None or compared < length:
+                want = self.bufsize
+                if length is not None:
+                    want = min(want, length - compared)
+                n = self._readinto(infile, new, want)
+                if not n:
+                    break
+                if hashobj is not None:
+                    hashobj.update(buffer(new, 0, n))
+                position = offset + compared
+                outfile.seek(position)
+                have = self._readinto(outfile, old, n)
+                for start in xrange(0, n, block):
+                    count = min(block, n - start)
+                    piece = buffer(new, start, count)
+                    if start + count > have or \
+                            piece != buffer(old, start, count):
+                        os.lseek(outfd, position + start, os.SEEK_SET)
+                        self._write(outfd, piece, count)
+                        rewritten += count
+                compared += n
+            return(compared, rewritten)
+        finally:
+            self.free.put(new)
+            self.free.put(old)
+
+    def zero(self, fd, offset, length):
+        """Write length bytes of zeros to fd at offset."""
+        self._start(None, fd, offset)
+        buf = self.free.get()
+        try:
+            ctypes.memset((ctypes.c_char * self.bufsize).from_buffer(buf), 0,
+                          self.bufsize)
+            os.lseek(fd, offset, os.SEEK_SET)
+            done = 0
+            while done < length:
+                n = min(self.bufsize, length - done)
+                self._write(fd, buf, n)
+                done += n
+        finally:
+            self.free.put(buf)
+
+    def _start(self, infd, outfd, offset):
+        """Note which of infd and outfd are to be read or written directly,
+        ahead of a transfer starting at offset."""
+        self.directfds = set()
+        self.degraded = set()
+        if self.direct:
+            for fd in (infd, outfd):
+                if fd is not None and directio.isdirect(fd):
+                    self.directfds.add(fd)
+            if outfd in self.directfds and offset % directio.ALIGN:
+                self._degrade(outfd)
+
+    def _degrade(self, fd):
+        """Stop using O_DIRECT on fd."""
+        directio.buffered(fd)
+        self.directfds.discard(fd)
+        self.degraded.add(fd)
+
+    def _readinto(self, infile, buf, want):
+        """Read up to want bytes from infile into buf. Direct reads are
+        rounded up to whole blocks."""
+        fd = infile.fileno()
+        if fd in self.directfds:
+            position = infile.tell()
+            if position % directio.ALIGN:
+                self._degrade(fd)
+            else:
+                try:
+                    n = infile.readinto(
+                        memoryview(buf)[:directio.roundup(want)])
+                except IOError as error:
+                    if error.errno != errno.EINVAL:
+                        raise
+                    self._degrade(fd)
+                    infile.seek(position)
+                else:
+                    if n > want:
+                        infile.seek(position + want)
+                        n = want
+                    return(n)
+        n = infile.readinto(memoryview(buf)[:want])
+        if fd in self.degraded:
+            self.fellback[0] += n
+        return(n)
+
+    def _write(self, fd, buf, n):
+        """Write n bytes of buf to fd, directly if we can."""
+        done = 0
+        if fd in self.directfds:
+            # Only the unaligned tail of a write has to be buffered.
+            aligned = n - n % directio.ALIGN
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            try:
+                _writeall(fd, buf, aligned)
+                done = aligned
+            except OSError as error:
+                if error.errno != errno.EINVAL:
+                    raise
+                os.lseek(fd, position, os.SEEK_SET)
+            if done == n:
+                return
+            self._degrade(fd)
+        _writeall(fd, buffer(buf, done), n - done)
+        if fd in self.degraded:
+            self.fellback[1] += n - done
+
+def _writeall(fd, buf, n):
+    done = 0
+    while done < n:
+        done += os.write(fd, buffer(buf, done, n - done))
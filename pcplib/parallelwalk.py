@@ -22,8 +22,11 @@ class ParallelWalk():
     walker = ParallelWalk(comm)
 
     To start the walker, call the execute() method. MPI rank 0 should pass 
-    in a seed directory. Currently seeds to MPI ranks other than rank 0 will 
-    be ignored.
+    in a seed directory, or a list of them. If there are fewer seeds than
+    ranks, rank 0 reads the seeds, and then up to SEEDDEPTH - 1 levels below
+    them, until there is a directory for every rank. The directories are then
+    shared out between all of the ranks so that they all have work from the
+    start. Seeds passed to MPI ranks other than rank 0 will be ignored.
     
     if rank == 0:
        seed = "/my/dir"
@@ -31,6 +34,10 @@ class ParallelWalk():
        seed = None
     results = walker.execute(seed)
 
+    Every node remembers which seed it was found under. While ProcessDir()
+    and ProcessFile() run, the seed attribute holds the index of that seed in
+    the seeds attribute, which is the same list on every rank.
+
     As it stands, the walker will walk the directory tree and then exit. It will
     return no data and perform no actions on file and directories it encounters.
 
@@ -46,6 +53,10 @@ class ParallelWalk():
     Tasks stuck in these functions will not be able to answer work requests from other
     nodes.
 
+    Poll() is called once each time round the walker's main loop, whether or not
+    the walker has work. Extend it to service other communication while the
+    walk is in progress.
+
     If you want to return summary data from the walker, use the results
     attribute. You can set results to a particular datatype by setting the results
     parameter when you instantiate the class. By default results is None.
@@ -65,6 +76,15 @@ class ParallelWalk():
     walker  = printfile(comm, results=0)
     listofresults = walker.Execute()
 
+    Work stealing: directories waiting to be read are kept apart from other
+    nodes. A rank asked for work gives away half of its directories (or, if
+    it has none, half of its other nodes), up to MAXSTEAL, taken from the
+    end of the queue it would process last. Idle ranks ask peers on the same
+    host first, and only go off-host once every local peer has said it has
+    no work. Each rank counts its steals and idle time in the stats
+    attribute. Execute() gathers them with gatherStats(), and on rank 0 the
+    walkstats attribute holds the list of the stats of every rank.
+
 
 """
     def __init__(self, comm, results=None):
@@ -77,11 +97,53 @@ class ParallelWalk():
         self.token = False
         self.first = True
         self.workrequest = False
-        self.items = deque()
+        self.seeds = []
+        self.seed = None
+        self.items = deque()    # files and other non-directories
+        self.dirs = deque()     # directories (and unknown types) to read
         self.results = results
         self.finished = False
+        # Peers on our host are asked for work before remote ones.
+        hosts = self.comm.allgather(MPI.Get_processor_name())
+        self.local = [r for r in self.others if hosts[r] == hosts[self.rank]]
+        self.remote = [r for r in self.others if hosts[r] != hosts[self.rank]]
+        self.localmisses = 0
+        self.idlestart = None
+        self.stats = {"seeded": 0,          # nodes dealt to us at the start
+                      "requests": 0,        # work requests we sent
+                      "steals": 0,          # ... which got us work
+                      "stolen": 0,          # nodes we were given
+                      "served": 0,          # work requests we answered
+                      "given": 0,           # nodes we gave away
+                      "processed": 0,       # nodes we processed
+                      "idletime": 0.0}      # seconds spent with no work
 
     
+    MAXSTEAL = 10000  # most nodes handed over in one steal
+    SEEDDEPTH = 2     # levels of directories rank 0 may read before dealing
+
+    def _queue(self, node):
+        if node[1] in (readdir.dirent.DT_DIR, readdir.dirent.DT_UNKNOWN):
+            self.dirs.appendleft(node)
+        else:
+            self.items.appendleft(node)
+
+    def _pending(self):
+        return(len(self.items) + len(self.dirs))
+
+    def _split(self):
+        """Remove and return the nodes to give to a thief. Only the nodes
+        handed over are touched."""
+        if self._pending() < 2:
+            return([])
+        if self.dirs:
+            queue = self.dirs
+        else:
+            queue = self.items
+        count = min(max(1, len(queue) // 2), self.MAXSTEAL)
+        popleft = queue.popleft
+        return([popleft() for i in xrange(count)])
+
     def ProcessDir(self, directoryname):
         """This method is a stub called for each directory the walker 
         encounters.  Extend it for your own needs.
@@ -103,6 +165,11 @@ class ParallelWalk():
         attribute; this is MPI gathered when the walkers are done."""
         pass
 
+    def Poll(self):
+        """This method is a stub called each time round the main loop. Extend it
+        for your own needs; keep it quick."""
+        pass
+
     def _CheckforRequests(self):
         """Listen for incoming communication data from our peers and answer
         accordigly.
@@ -120,15 +187,11 @@ class ParallelWalk():
             tag = status.tag
 
             if tag == 0:
-                numitems = len(self.items)
-                if numitems > 1:
-                    split = random.randrange(1, numitems)
-    #            or split list in half
-    #                split = numitems / 2
-                    senditems = list(self.items)[:split]
-                    remainingitems = list(self.items)[split:]
-                    self.items = deque(remainingitems)
+                senditems = self._split()
+                if senditems:
                     self.comm.send(senditems, dest=source, tag=1)
+                    self.stats["served"] += 1
+                    self.stats["given"] += len(senditems)
                     if source < self.rank:
                         self.colour = "Black"
                 else:
@@ -137,7 +200,13 @@ class ParallelWalk():
             if tag == 1:
                 self.mpirequest.wait()
                 if request != "NoWork":
-                    self.items.extendleft(request)
+                    for node in request:
+                        self._queue(node)
+                    self.stats["steals"] += 1
+                    self.stats["stolen"] += len(request)
+                    self.localmisses = 0
+                elif source in self.local:
+                    self.localmisses += 1
                 self.workrequest = False
 
             if tag == 2:
@@ -147,11 +216,19 @@ class ParallelWalk():
                 self.finished = True
         return()
 
-    def _ProcessNode(self):
-        """Process a node in the directory tree. If the node is another directory, 
-        enumerate its contents and add it to the list of nodes to be processed in the 
-        future."""
-        filename, filetype = self.items.pop()
+    def _ProcessNode(self, node=None):
+        """Process a node in the directory tree, or the next one queued if
+        node is None. If the node is another directory, enumerate its contents
+        and add it to the list of nodes to be processed in the future."""
+        # Files first; directories are left for thieves as long as possible
+        # as they are what generates more work.
+        if node is not None:
+            filename, filetype, self.seed = node
+        elif self.items:
+            filename, filetype, self.seed = self.items.pop()
+        else:
+            filename, filetype, self.seed = self.dirs.pop()
+        self.stats["processed"] += 1
 
         try:
             # If the filesystem supports readdir d_type, then we will know if the node is
@@ -167,10 +244,9 @@ class ParallelWalk():
             # If we a directory, enumerate its contents and add them to the list of nodes
             # to be processed.
             if filetype == readdir.dirent.DT_DIR:
-                for node in readdir.readdir(filename):
-                    if not node.d_name in (".",".."):
-                        fullname = os.path.join(filename, node.d_name)
-                        self.items.appendleft((fullname, node.d_type))
+                join = os.path.join
+                for name, d_type, inode in readdir.scandir(filename):
+                    self._queue((join(filename, name), d_type, self.seed))
             # Call the processing functions on the directory or file.
                 self.ProcessDir(filename)
             else:
@@ -181,10 +257,19 @@ class ParallelWalk():
         return()
 
     def _AskForWork(self):
-        """Send a work request to a random peer."""
-        target = random.choice(self.others)
+        """Send a work request to a random peer, on our own host unless all of
+        those have recently turned us down."""
+        if not self.others:
+            return()
+        if self.local and (self.localmisses < len(self.local) or
+                           not self.remote):
+            target = random.choice(self.local)
+        else:
+            target = random.choice(self.remote)
+            self.localmisses = 0
         self.mpirequest = self.comm.isend("Hungry", dest=target, tag=0)
         self.workrequest = True
+        self.stats["requests"] += 1
 
     def _CheckForTermination(self):
         """Dijkstra distributed termiation algorithm."""
@@ -201,6 +286,7 @@ class ParallelWalk():
                 # Tell the other workers that they are done, and then quit.
                 self._sendShutdown()            
                 self.finished = True
+                return()
 
         # If we have the token, set the process and token colours as then send
         # the token on to the next process.
@@ -221,6 +307,21 @@ class ParallelWalk():
                     self.comm.send(self.token, self.nextworker, tag=2)
                     self.token = False
 
+    def _Drain(self):
+        """Once the walk is over, keep answering work requests until every
+        rank has had the answer to its own. Otherwise a late answer is left
+        behind on the communicator, and can be picked up by the next walker
+        if MPI reuses the communicator's context."""
+        barrier = None
+        while True:
+            self._CheckforRequests()
+            # Only join the barrier once our own request has been answered;
+            # when it completes, everyone's has.
+            if barrier is None and not self.workrequest:
+                barrier = self.comm.Ibarrier()
+            if barrier is not None and barrier.Test():
+                return()
+
     def _sendShutdown(self):
         """Send shutdown signal to the other ranks."""
         for dest in range(1, self.workers):
@@ -232,20 +333,52 @@ class ParallelWalk():
         data = self.comm.gather(self.results, root=0)
         return(data)
 
+    def gatherStats(self):
+        """Return a list of the stats dicts of every rank on rank 0, None on
+        the other ranks. Must be called by all ranks after Execute()."""
+        return(self.comm.gather(self.stats, root=0))
+
     def _tidy(self):
         self.comm.Free()
 
+    def _expandSeeds(self):
+        """Read the queued directories a level at a time, up to SEEDDEPTH
+        levels, until there are at least as many directories as ranks. Only
+        rank 0 does this, before the walk starts; the files found stay in
+        its queue."""
+        depth = 0
+        while self.dirs and len(self.dirs) < self.workers and \
+                depth < self.SEEDDEPTH:
+            level = list(self.dirs)
+            self.dirs.clear()
+            for node in level:
+                self._ProcessNode(node)
+            depth += 1
+
     def Execute(self, seed):
         """This method starts the walkers. The rank 0 MPI walker takes a seed parameter,
-        which is the name of the first directory to walk.
+        which is the name of the first directory to walk, or a list of directories.
 
         The rank 0 walker will return a list containing the results attributes for all of
         the walkers. This can be used to print out summary statistics etc.
         """
-        # Initialize the rank0 walker with the seed directory.
-        # TODO: Be able to take multiple seeds
+        # Deal the seed directories, or the directories just below them,
+        # out to all of the ranks.
+        if self.rank == 0 and isinstance(seed, basestring):
+            seed = [seed]
+        self.seeds = self.comm.bcast(seed, root=0)
+        hands = None
+        if self.rank == 0:
+            for i, top in enumerate(self.seeds):
+                self.dirs.appendleft((top, readdir.dirent.DT_DIR, i))
+            self._expandSeeds()
+            nodes = list(reversed(self.dirs))
+            self.dirs.clear()
+            hands = [nodes[r::self.workers] for r in range(self.workers)]
+        hand = self.comm.scatter(hands, root=0)
+        self.dirs.extendleft(hand)
+        self.stats["seeded"] = len(hand)
         if self.rank == 0:
-            self.items.append((seed, 4))
             self.token = "White"
         else:
             self.token = False
@@ -256,17 +389,27 @@ class ParallelWalk():
 
         while self.finished == False:
             self._CheckforRequests ()
-            if len(self.items) > 0:
+            self.Poll()
+            if self._pending() > 0:
+                if self.idlestart is not None:
+                    self.stats["idletime"] += time.time() - self.idlestart
+                    self.idlestart = None
                 self._ProcessNode()
             else:
+                if self.idlestart is None:
+                    self.idlestart = time.time()
                 # We only want one request in-flight, otherwise we
                 # ping-pong worklist between nodes.
                 if self.workrequest == False:
                     self._AskForWork()
             # If we have no more work, we might be 
-            if len(self.items) == 0:
+            if self._pending() == 0:
                 self._CheckForTermination()
+        if self.idlestart is not None:
+            self.stats["idletime"] += time.time() - self.idlestart
+        self._Drain()
         # Gather the summary data from other ranks and then exit.
         data = self.gatherResults()
+        self.walkstats = self.gatherStats()
         self._tidy()
         return(data)
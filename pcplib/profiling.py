@@ -0,0 +1,139 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Opt-in profiling of a pcp rank.
+
+start() runs cProfile over the calling thread. Hot paths can also be timed
+as named spans: timed() and timedgenerator() wrap a function so that its
+calls are counted and timed, and TimedConnection does the same for each SQL
+statement run through an sqlite3 connection. Nothing is wrapped unless
+profiling was asked for, so it costs nothing otherwise.
+
+stop() writes pcp.<rank>.prof (pstats format) and pcp.<rank>.spans (JSON of
+span: [calls, total secs, longest call secs]) to the directory given to
+start(). bench/pcpprof.py merges the files from every rank into one report.
+
+    profiling.start("/tmp/profile", rank)
+    module.function = profiling.timed("function", module.function)
+    db = profiling.TimedConnection(db)
+    ...
+    profiling.stop()
+"""
+import cProfile
+import json
+import os
+import socket
+import threading
+import time
+
+SPANS = {}  # name: [calls, total secs, longest call secs]
+# Wrapped functions also run in the -Sf and directory index thread pools.
+_lock = threading.Lock()
+_profiler = None
+_directory = None
+_rank = None
+
+def start(directory, rank):
+    """Start profiling this rank, writing the results to directory."""
+    global _profiler, _directory, _rank
+    _directory = directory
+    _rank = rank
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another rank got there first.
+            if not os.path.isdir(directory):
+                raise
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+def stop():
+    """Stop profiling and write out the results. Does nothing if start() was
+    not called."""
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.disable()
+    _profiler.dump_stats(os.path.join(_directory, "pcp.%i.prof" % _rank))
+    _profiler = None
+    fh = open(os.path.join(_directory, "pcp.%i.spans" % _rank), "w")
+    with _lock:
+        json.dump({"rank": _rank, "host": socket.gethostname(),
+                   "spans": SPANS}, fh, indent=1, sort_keys=True)
+    fh.close()
+
+def _record(name, elapsed):
+    with _lock:
+        span = SPANS.get(name)
+        if span is None:
+            span = SPANS[name] = [0, 0.0, 0.0]
+        span[0] += 1
+        span[1] += elapsed
+        if elapsed > span[2]:
+            span[2] = elapsed
+
+def timed(name, function):
+    """Return function wrapped so that its calls are recorded as span
+    name."""
+    def wrapper(*args, **kwargs):
+        begin = time.time()
+        try:
+            return(function(*args, **kwargs))
+        finally:
+            _record(name, time.time() - begin)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return(wrapper)
+
+def timedgenerator(name, function):
+    """Like timed(), for a generator function. The time spent producing
+    every item counts towards the call."""
+    def wrapper(*args, **kwargs):
+        elapsed = 0.0
+        begin = time.time()
+        try:
+            for item in function(*args, **kwargs):
+                elapsed += time.time() - begin
+                yield item
+                begin = time.time()
+            elapsed += time.time() - begin
+        finally:
+            _record(name, elapsed)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return(wrapper)
+
+class TimedConnection():
+    """An sqlite3 connection which records each statement executed through
+    it as a span named after the statement. Only the execute() call is
+    timed, not reading the rows back from the cursor it returns."""
+    def __init__(self, db):
+        self.db = db
+
+    def _name(self, sql):
+        return("sql " + " ".join(sql.split())[:60])
+
+    def execute(self, sql, *args):
+        begin = time.time()
+        try:
+            return(self.db.execute(sql, *args))
+        finally:
+            _record(self._name(sql), time.time() - begin)
+
+    def executemany(self, sql, *args):
+        begin = time.time()
+        try:
+            return(self.db.executemany(sql, *args))
+        finally:
+            _record(self._name(sql), time.time() - begin)
+
+    def __enter__(self):
+        return(self.db.__enter__())
+
+    def __exit__(self, *exc):
+        return(self.db.__exit__(*exc))
+
+    def __getattr__(self, name):
+        return(getattr(self.db, name))
@@ -4,9 +4,20 @@
 
 import ctypes
 import os
+import platform
+import struct
+import threading
 """
 This module provides a python interface to the readdir
 system call.
+
+readdir() returns a list of dirent objects. scandir() is much cheaper per
+entry: it fetches entries from the kernel with getdents64 in large batches
+and yields (name, d_type, inode) tuples.
+
+    for name, d_type, inode in scandir("/my/dir"):
+        if d_type == dirent.DT_DIR:
+            ...
 """
 
 # Ctypes boilerplate for readdir/opendir/closedir
@@ -76,3 +87,69 @@ def readdir(directory):
             entries.append(d)
     _closedir(dirp)
     return (entries)
+
+
+# getdents64 arrived in glibc 2.30; older glibc needs the raw system call.
+_GETDENTS64 = {"x86_64": 217, "aarch64": 61, "ppc64le": 202, "ppc64": 202}
+if hasattr(_clib, "getdents64"):
+    _getdents64 = _clib.getdents64
+    _getdents64.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t]
+    _getdents64.restype = ctypes.c_ssize_t
+elif platform.machine() in _GETDENTS64:
+    _nr = _GETDENTS64[platform.machine()]
+    def _getdents64(fd, buf, size):
+        return(_clib.syscall(_nr, fd, buf, ctypes.c_size_t(size)))
+else:
+    _getdents64 = None
+
+# struct linux_dirent64 {u64 d_ino; s64 d_off; u16 d_reclen; u8 d_type;
+# char d_name[];}
+_header = struct.Struct("=QqHB")
+
+# Each thread reuses one getdents64 buffer, rather than allocating and
+# zeroing a new one for every directory. The entries are copied out of it
+# before scandir yields any of them, so generators in the same thread can
+# share it.
+_buffers = threading.local()
+
+def _buffer(size):
+    """Return this thread's getdents64 buffer, at least size bytes long."""
+    buf = getattr(_buffers, "buf", None)
+    if buf is None or len(buf) < size:
+        buf = ctypes.create_string_buffer(size)
+        _buffers.buf = buf
+    return(buf)
+
+def scandir(directory, bufsize=1048576):
+    """Generator returning a (name, d_type, inode) tuple for each entry in
+    directory, other than "." and "..". Entries are read bufsize bytes at a
+    time."""
+    if _getdents64 is None:
+        for entry in readdir(directory):
+            if entry.d_name not in (".", ".."):
+                yield (entry.d_name, entry.d_type, entry.ino_t)
+        return
+
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        buf = _buffer(bufsize)
+        unpack = _header.unpack_from
+        namestart = _header.size
+        while True:
+            nread = _getdents64(fd, buf, bufsize)
+            if nread < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), directory)
+            if nread == 0:
+                break
+            data = ctypes.string_at(buf, nread)
+            pos = 0
+            while pos < nread:
+                inode, offset, reclen, d_type = unpack(data, pos)
+                name = data[pos + namestart:data.index("\0",
+                                                       pos + namestart)]
+                pos += reclen
+                if name != "." and name != "..":
+                    yield (name, d_type, inode)
+    finally:
+        os.close(fd)
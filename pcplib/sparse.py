@@ -0,0 +1,78 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Sparse file support.
+
+A file with fewer blocks allocated than its size has holes, which read back
+as zeros. extents() finds the ranges of a file which do hold data with
+lseek(SEEK_DATA) and lseek(SEEK_HOLE), so that a copy can skip the holes
+and leave them as holes in the destination. hashzeros() and zerodigest()
+checksum holes without reading them, giving the same digest as reading the
+zeros would.
+
+A filesystem without SEEK_DATA support has its files reported as all data.
+
+    if issparse(os.fstat(fd)):
+        for start, end in extents(fd, offset, length):
+            copy(start, end - start)
+"""
+import errno
+import os
+
+import checksum
+
+# python 2 does not define these; the values are the same on every Linux.
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
+
+_ZEROS = "\0" * 1048576
+_digests = {}  # (algorithm, length): digest of length zeros
+
+def issparse(st):
+    """Does the os.stat result st look like a file with holes?"""
+    return(st.st_blocks * 512 < st.st_size)
+
+def extents(fd, offset=0, length=None):
+    """Return a list of (start, end) byte ranges holding the data of fd
+    between offset and offset + length, or the end of the file if length is
+    None. The rest of that range is hole."""
+    end = os.fstat(fd).st_size
+    if length is not None:
+        end = min(end, offset + length)
+    found = []
+    position = offset
+    while position < end:
+        try:
+            start = os.lseek(fd, position, SEEK_DATA)
+        except OSError, error:
+            if error.errno == errno.ENXIO:
+                # Nothing but hole from here to the end of the file.
+                break
+            if error.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+                # The filesystem cannot tell us; it is all data.
+                found.append((position, end))
+                break
+            raise
+        if start >= end:
+            break
+        stop = min(os.lseek(fd, start, SEEK_HOLE), end)
+        found.append((start, stop))
+        position = stop
+    return(found)
+
+def hashzeros(md5hash, count):
+    """Feed count zero bytes to the hash object md5hash."""
+    while count > 0:
+        n = min(count, len(_ZEROS))
+        md5hash.update(buffer(_ZEROS, 0, n))
+        count -= n
+
+def zerodigest(algorithm, count):
+    """The checksum of count zero bytes with algorithm."""
+    key = (algorithm, count)
+    if key not in _digests:
+        md5hash = checksum.new(algorithm)
+        hashzeros(md5hash, count)
+        _digests[key] = md5hash.hexdigest()
+    return(_digests[key])
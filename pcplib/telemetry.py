@@ -0,0 +1,77 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Periodic progress records for long running copies.
+
+A record is a dict of numbers, with a "ranks" entry holding a dict of
+per-rank numbers keyed by rank. TelemetryWriter appends each record to a
+JSON lines file and/or replaces a Prometheus textfile (for the node
+exporter's textfile collector) with it.
+
+    writer = TelemetryWriter(jsonfile="pcp.jsonl", promfile="pcp.prom")
+    writer.write({"time": time.time(), "copy_remaining": 10,
+                  "ranks": {1: {"bytes_copied": 4096}}})
+    writer.close()
+
+In the Prometheus file every number becomes a gauge called pcp_<key>, and
+the per-rank numbers get a rank label. Entries which are None are left out.
+"""
+import json
+import os
+
+def prometheus(record):
+    """Format record in the Prometheus text exposition format."""
+    lines = []
+    for key in sorted(record):
+        value = record[key]
+        if key == "ranks" or value is None:
+            continue
+        lines.append("# TYPE pcp_%s gauge" % key)
+        lines.append("pcp_%s %s" % (key, _number(value)))
+    ranks = record.get("ranks", {})
+    keys = sorted(set(key for values in ranks.itervalues() for key in values))
+    for key in keys:
+        lines.append("# TYPE pcp_rank_%s gauge" % key)
+        for rank in sorted(ranks):
+            value = ranks[rank].get(key)
+            if value is not None:
+                lines.append('pcp_rank_%s{rank="%s"} %s'
+                             % (key, rank, _number(value)))
+    return("\n".join(lines) + "\n")
+
+def _number(value):
+    if isinstance(value, float):
+        return(repr(value))
+    return(str(value))
+
+class TelemetryWriter():
+    """Write telemetry records to jsonfile, promfile, or both."""
+    def __init__(self, jsonfile=None, promfile=None):
+        self.promfile = promfile
+        self.jsonfh = None
+        if jsonfile:
+            self.jsonfh = open(jsonfile, "a")
+
+    def write(self, record):
+        if self.jsonfh:
+            ranks = dict((str(rank), values) for rank, values
+                         in record.get("ranks", {}).iteritems())
+            line = dict(record, ranks=ranks)
+            self.jsonfh.write(json.dumps(line, sort_keys=True) + "\n")
+            self.jsonfh.flush()
+        if self.promfile:
+            # Write a new file and rename it into place, so that the
+            # collector never reads half a file.
+            tmpfile = "%s.%i.tmp" % (self.promfile, os.getpid())
+            fh = open(tmpfile, "w")
+            try:
+                fh.write(prometheus(record))
+            finally:
+                fh.close()
+            os.rename(tmpfile, self.promfile)
+
+    def close(self):
+        if self.jsonfh:
+            self.jsonfh.close()
+            self.jsonfh = None
@@ -0,0 +1,48 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+"""
+Token bucket rate limiting.
+
+A TokenBucket lets through rate units per second on average, with bursts of
+up to one second's worth. consume(n) takes n tokens, sleeping first if the
+bucket has run dry. A rate of 0 means no limit, and consume() returns
+straight away. The rate can be changed at any time, and a bucket can be
+shared between threads.
+
+    bandwidth = TokenBucket(100 * 1048576)
+    bandwidth.consume(len(data))
+    bandwidth.setrate(50 * 1048576)
+"""
+import threading
+import time
+
+class TokenBucket():
+    def __init__(self, rate=0):
+        self.waited = 0.0  # seconds spent sleeping in consume()
+        self.lock = threading.Lock()
+        self.setrate(rate)
+
+    def setrate(self, rate):
+        """Allow rate units per second from now on; 0 for no limit."""
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.time()
+
+    def consume(self, n):
+        """Take n tokens, sleeping until the rate allows it."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # Go into debt rather than waiting for n tokens to build up, so
+            # that n can be larger than the bucket.
+            self.tokens -= n
+            wait = -self.tokens / float(self.rate)
+            if wait > 0:
+                self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
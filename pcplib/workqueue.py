@@ -0,0 +1,90 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+import itertools
+from collections import deque
+
+class WorkQueue():
+    """A FIFO queue of tasks which will not hand a task back to the rank
+    which last ran it.
+
+    Tasks which have never been run are held in a single queue. Tasks which
+    have been run before are held in a separate queue for each rank, so
+    finding a task which was not last run by a particular rank means looking
+    at no more than two of those queues.
+
+    q = WorkQueue()
+    q.put(task)                  # never run
+    q.put(task, lastrank=3)      # must not go back to rank 3
+    task = q.get(3)              # None if there is nothing rank 3 may run
+    task = q.get(-1)             # ignore the last rank restriction
+    task = q.getbest(3, score)   # lowest score(task) of the first few
+    """
+    def __init__(self):
+        self.fresh = deque()
+        self.byrank = {}
+        self.length = 0
+
+    def __len__(self):
+        return(self.length)
+
+    def put(self, task, lastrank=0, front=False):
+        """Add a task to the queue. lastrank is the rank the task was last run
+        on, or 0 if it has not been run yet. If front is set the task will be
+        handed out before the tasks already in the queue."""
+        if lastrank == 0:
+            queue = self.fresh
+        else:
+            queue = self.byrank.get(lastrank)
+            if queue is None:
+                queue = self.byrank[lastrank] = deque()
+        if front:
+            queue.appendleft(task)
+        else:
+            queue.append(task)
+        self.length += 1
+
+    def get(self, rank):
+        """Return the next task which was not last run on rank, or None if
+        there is no such task. Pass rank=-1 to take any task."""
+        if self.fresh:
+            self.length -= 1
+            return(self.fresh.popleft())
+        # Only non-empty queues are kept, so we look at most two of them.
+        for lastrank, queue in self.byrank.iteritems():
+            if lastrank != rank:
+                task = queue.popleft()
+                if not queue:
+                    del self.byrank[lastrank]
+                self.length -= 1
+                return(task)
+        return(None)
+
+    def getbest(self, rank, score, window=32):
+        """Like get(), but look at the first window tasks which were not last
+        run on rank and return the one with the lowest score(task). Tasks
+        scored None are not eligible. Returns None if no task is."""
+        best = None
+        seen = 0
+        queues = [(0, self.fresh)] + [(lastrank, queue) for lastrank, queue
+                                      in self.byrank.iteritems()
+                                      if lastrank != rank]
+        for lastrank, queue in queues:
+            for i, task in enumerate(itertools.islice(queue, window - seen)):
+                value = score(task)
+                if value is not None and (best is None or value < best[0]):
+                    best = (value, lastrank, queue, i)
+                    if value == 0:
+                        break
+            seen += min(len(queue), window - seen)
+            if seen >= window or (best and best[0] == 0):
+                break
+        if best is None:
+            return(None)
+        value, lastrank, queue, i = best
+        task = queue[i]
+        del queue[i]
+        if not queue and lastrank != 0:
+            del self.byrank[lastrank]
+        self.length -= 1
+        return(task)
@@ -120,5 +120,352 @@ testmultichecksumchunk() {
     done
 }
 
-    
+
+testpipelinecopy() {
+    FILES=20
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -w 8 -b 1 -c  $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    for X in `seq 1 $FILES` ; do
+	cmp $SHUNIT_TMPDIR/a/testfile$X $SHUNIT_TMPDIR/b/testfile$X
+	assertEquals "Pipelined copy failed" 0 $?
+    done
+}
+
+testcopyengines() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    for ENGINE in copy_file_range sendfile splice python ; do
+	rm -rf $SHUNIT_TMPDIR/b
+	mpirun -n $RANKS $PCP -e $ENGINE -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+	assertEquals "pcp -e $ENGINE failed" 0 $?
+	for X in `seq 1 $FILES` ; do
+	    cmp $SHUNIT_TMPDIR/a/testfile$X $SHUNIT_TMPDIR/b/testfile$X
+	    assertEquals "Copy with $ENGINE engine failed" 0 $?
+	done
+    done
+}
+
+testpipelinebuffers() {
+    RANKS=3
+    # Sizes either side of the buffer size and a chunked file.
+    for X in 63 64 65 200 ; do
+	dd if=/dev/urandom bs=1k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1k count=2500 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -c -b 1 -Iq 2 -Ib 64k $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    for X in testfile63 testfile64 testfile65 testfile200 bigfile ; do
+	cmp $SHUNIT_TMPDIR/a/$X $SHUNIT_TMPDIR/b/$X
+	assertEquals "Copy of $X through pipeline failed" 0 $?
+    done
+}
+
+testpipelinereaderrors() {
+    # More failed reads than there are buffers must not leave the pipeline
+    # without any. A write-only fd fails every read.
+    (cd .. && timeout 60 python -c "
+import os
+from pcplib import iopipeline
+pipeline = iopipeline.IOPipeline(depth=2, bufsize=65536)
+fd = os.open('/dev/null', os.O_WRONLY)
+for attempt in range(5):
+    try:
+        pipeline.run(fd, None, 0, 1048576)
+    except IOError:
+        continue
+    raise SystemExit('read error not raised')
+")
+    assertEquals "Pipeline failed or hung after read errors" 0 $?
+}
+
+testchecksummanifest() {
+    RANKS=3
+    for X in `seq 1 5`  ; do
+	dd if=/dev/urandom bs=1k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -b 1 -ca sha256 -cm $SHUNIT_TMPDIR/manifest $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    grep -q "^SHA256-TREE-1048576 (bigfile) = " $SHUNIT_TMPDIR/manifest
+    assertEquals "No whole-file checksum for chunked file" 0 $?
+    (cd $SHUNIT_TMPDIR/b && grep -v TREE $SHUNIT_TMPDIR/manifest | sha256sum -c --quiet)
+    assertEquals "Manifest checksums do not match copy" 0 $?
+}
+
+testchunklayout() {
+    RANKS=4
+    # 6 Mbytes in 3 Mbyte chunks with 3 workers: 3 chunks of 2 Mbytes.
+    dd if=/dev/urandom bs=1M count=6 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -b 3 -cm $SHUNIT_TMPDIR/manifest $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    grep -q "^MD5-TREE-2097152 (bigfile) = " $SHUNIT_TMPDIR/manifest
+    assertEquals "Unexpected chunk size" 0 $?
+    # 5000k in 2 Mbyte chunks would leave a 0.9 Mbyte last chunk, so 1
+    # Mbyte chunks are used.
+    rm -rf $SHUNIT_TMPDIR/b
+    dd if=/dev/urandom bs=1k count=5000 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -b 3 -cm $SHUNIT_TMPDIR/manifest $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    grep -q "^MD5-TREE-1048576 (bigfile) = " $SHUNIT_TMPDIR/manifest
+    assertEquals "Uneven chunks" 0 $?
+    cmp $SHUNIT_TMPDIR/a/bigfile $SHUNIT_TMPDIR/b/bigfile
+    assertEquals "Chunked copy failed" 0 $?
+}
+
+testmultiplesources() {
+    RANKS=3
+    for P in p1 p2 p3 ; do
+	mkdir -p $SHUNIT_TMPDIR/a/$P/sub
+	dd if=/dev/urandom bs=1k count=100 of=$SHUNIT_TMPDIR/a/$P/testfile > /dev/null 2>&1
+	dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/$P/sub/bigfile > /dev/null 2>&1
+    done
+    printf "$SHUNIT_TMPDIR/a/p3\t$SHUNIT_TMPDIR/b/q3\n" > $SHUNIT_TMPDIR/a/pairs
+    mpirun -n $RANKS $PCP -b 1 -c $SHUNIT_TMPDIR/a/p1 $SHUNIT_TMPDIR/b/q1 \
+	-m $SHUNIT_TMPDIR/a/p2 $SHUNIT_TMPDIR/b/q2 -mf $SHUNIT_TMPDIR/a/pairs
+    assertEquals "pcp failed" 0 $?
+    for X in 1 2 3 ; do
+	diff -r $SHUNIT_TMPDIR/a/p$X $SHUNIT_TMPDIR/b/q$X
+	assertEquals "Copy of p$X failed" 0 $?
+    done
+}
+
+testseededwalk() {
+    RANKS=3
+    for D in d1 d2 d3 d4 d2/e ; do
+	mkdir -p $SHUNIT_TMPDIR/a/$D
+	for X in `seq 1 5`  ; do
+	    echo $X > $SHUNIT_TMPDIR/a/$D/testfile$X
+	done
+    done
+    # A single source is read by rank 0 and its directories dealt out, so
+    # more than one rank starts the walk with work.
+    STARTED=`mpirun -n $RANKS $PCP -v $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b \
+	| grep -c "^R[0-9]*: started with [1-9]"`
+    assertTrue "Only $STARTED ranks started with work" "[ $STARTED -gt 1 ]"
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+}
+
+testoverlapscan() {
+    RANKS=4
+    for D in d1 d2 d3 d2/e ; do
+	mkdir -p $SHUNIT_TMPDIR/a/$D
+	for X in `seq 1 20`  ; do
+	    dd if=/dev/urandom bs=1k count=$X of=$SHUNIT_TMPDIR/a/$D/testfile$X > /dev/null 2>&1
+	done
+    done
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -O 1 -b 1 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy while scanning failed" 0 $?
+}
+
+testsizeaware() {
+    RANKS=3
+    for X in `seq 1 10`  ; do
+	dd if=/dev/urandom bs=10k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1k count=3500 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -S -b 1 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b | grep -q "Predicted makespan"
+    assertEquals "No makespan prediction" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Size-aware copy failed" 0 $?
+}
+
+testgroupleaders() {
+    RANKS=7
+    for X in `seq 1 20`  ; do
+	dd if=/dev/urandom bs=10k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1k count=3500 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -G 3 -b 1 -c -w 2 -K $SHUNIT_TMPDIR/checkpoint -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Group leader copy failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/checkpoint
+    assertEquals "Verify from checkpoint failed" 0 $?
+    rm -f $SHUNIT_TMPDIR/checkpoint*
+}
+
+testtelemetry() {
+    RANKS=3
+    for X in `seq 1 10`  ; do
+	dd if=/dev/urandom bs=10k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -c -T $SHUNIT_TMPDIR/progress.jsonl -Tp $SHUNIT_TMPDIR/progress.prom $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    tail -1 $SHUNIT_TMPDIR/progress.jsonl | grep -q '"copy_remaining": 0'
+    assertEquals "No final progress record" 0 $?
+    grep -q 'pcp_rank_files_copied{rank="1"}' $SHUNIT_TMPDIR/progress.prom
+    assertEquals "No per-rank Prometheus metrics" 0 $?
+    rm -f $SHUNIT_TMPDIR/progress.*
+}
+
+testpreservedirs() {
+    RANKS=3
+    for D in d1/e1 d1/e2 d2/e1/f1 ; do
+	mkdir -p $SHUNIT_TMPDIR/a/$D
+	echo $D > $SHUNIT_TMPDIR/a/$D/testfile
+    done
+    touch -t 200001020300.00 $SHUNIT_TMPDIR/a/d1/e1 $SHUNIT_TMPDIR/a/d2/e1/f1 $SHUNIT_TMPDIR/a/d2
+    chmod 555 $SHUNIT_TMPDIR/a/d1/e1 $SHUNIT_TMPDIR/a/d2
+    mpirun -n $RANKS $PCP -p $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "copy failed" 0 $?
+    for D in d1 d1/e1 d1/e2 d2 d2/e1 d2/e1/f1 ; do
+	assertEquals "Directory $D differs" "`stat -c'%a %Y' $SHUNIT_TMPDIR/a/$D`" \
+	    "`stat -c'%a %Y' $SHUNIT_TMPDIR/b/$D`"
+    done
+    chmod -R u+w $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+}
+
+testsmallfiles() {
+    RANKS=4
+    for X in `seq 1 100`  ; do
+	dd if=/dev/urandom bs=1k count=$(($X % 10)) of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    chmod 600 $SHUNIT_TMPDIR/a/testfile1*
+    touch -t 200001020300.00 $SHUNIT_TMPDIR/a/testfile*
+    mpirun -n $RANKS $PCP -p -c -w 2 -Sf 16k -St 4 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b | grep -q "small files in bundles"
+    assertEquals "No small files copied in bundles" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copies differ" 0 $?
+    for X in 1 10 11 55 ; do
+	assertEquals "testfile$X attributes differ" "`stat -c'%a %Y' $SHUNIT_TMPDIR/a/testfile$X`" \
+	    "`stat -c'%a %Y' $SHUNIT_TMPDIR/b/testfile$X`"
+    done
+}
+
+testdirectio() {
+    RANKS=3
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/testfile1 > /dev/null 2>&1
+    dd if=/dev/urandom bs=1000 count=1234 of=$SHUNIT_TMPDIR/a/testfile2 > /dev/null 2>&1
+    echo small > $SHUNIT_TMPDIR/a/testfile3
+    mpirun -n $RANKS $PCP -Id $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copies differ" 0 $?
+    rm -rf $SHUNIT_TMPDIR/b
+    mpirun -n $RANKS $PCP -Id -c -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "checksummed copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Checksummed copies differ" 0 $?
+    rm -rf $SHUNIT_TMPDIR/b
+    mpirun -n $RANKS $PCP -Id -c -Sf 2M $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "bundled copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Bundled copies differ" 0 $?
+}
+
+testsparse() {
+    RANKS=3
+    truncate -s 10M $SHUNIT_TMPDIR/a/sparsefile
+    dd if=/dev/urandom bs=1M count=1 seek=4 conv=notrunc of=$SHUNIT_TMPDIR/a/sparsefile > /dev/null 2>&1
+    truncate -s 3M $SHUNIT_TMPDIR/a/holefile
+    mpirun -n $RANKS $PCP -c -b 2 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copies differ" 0 $?
+    assertEquals "Holes not preserved" "`du -k $SHUNIT_TMPDIR/a/sparsefile | cut -f1`" \
+	"`du -k $SHUNIT_TMPDIR/b/sparsefile | cut -f1`"
+}
+
+testincremental() {
+    RANKS=3
+    mkdir -p $SHUNIT_TMPDIR/a/d1
+    for X in `seq 1 10`  ; do
+	echo $X > $SHUNIT_TMPDIR/a/d1/testfile$X
+    done
+    mpirun -n $RANKS $PCP -p $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "copy failed" 0 $?
+    echo changed >> $SHUNIT_TMPDIR/a/d1/testfile1
+    echo new > $SHUNIT_TMPDIR/a/d1/testfile11
+    mpirun -n $RANKS $PCP -i $SHUNIT_TMPDIR/b $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+    assertEquals "incremental copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+    assertEquals "Incremental copy differs" 0 $?
+    assertEquals "Unchanged file not linked" 2 `stat -c%h $SHUNIT_TMPDIR/c/d1/testfile2`
+    assertEquals "Changed file linked" 1 `stat -c%h $SHUNIT_TMPDIR/c/d1/testfile1`
+    touch -d "+1 hour" $SHUNIT_TMPDIR/a/d1/testfile1
+    mpirun -n $RANKS $PCP -u $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "update copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Update copy differs" 0 $?
+}
+
+testdelta() {
+    RANKS=3
+    dd if=/dev/urandom bs=1M count=6 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "copy failed" 0 $?
+    echo changed | dd of=$SHUNIT_TMPDIR/a/bigfile bs=1k seek=3000 conv=notrunc > /dev/null 2>&1
+    dd if=/dev/urandom bs=1k count=100 >> $SHUNIT_TMPDIR/a/bigfile 2> /dev/null
+    touch -d "+1 hour" $SHUNIT_TMPDIR/a/bigfile
+    mpirun -n $RANKS $PCP -u -ud 1M -b 2 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b | grep -q "delta unchanged"
+    assertEquals "No delta update" 0 $?
+    cmp $SHUNIT_TMPDIR/a/bigfile $SHUNIT_TMPDIR/b/bigfile
+    assertEquals "Delta update differs" 0 $?
+    # Direct I/O, and a source hole over data in the destination.
+    truncate -s 8M $SHUNIT_TMPDIR/a/bigfile
+    dd if=/dev/zero of=$SHUNIT_TMPDIR/a/bigfile bs=1M count=2 seek=1 conv=notrunc > /dev/null 2>&1
+    fallocate -p -o 1M -l 2M $SHUNIT_TMPDIR/a/bigfile 2> /dev/null
+    touch -d "+2 hours" $SHUNIT_TMPDIR/a/bigfile
+    mpirun -n $RANKS $PCP -u -ud 1M -b 2 -c -Id $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b | grep -q "delta unchanged"
+    assertEquals "No direct delta update" 0 $?
+    cmp $SHUNIT_TMPDIR/a/bigfile $SHUNIT_TMPDIR/b/bigfile
+    assertEquals "Direct delta update differs" 0 $?
+    mpirun -n $RANKS $PCP -ud 1M $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b | grep -q "Error: -ud"
+    assertEquals "-ud accepted without -u or -i" 0 $?
+}
+
+testthrottle() {
+    RANKS=3
+    for X in `seq 1 5`  ; do
+	dd if=/dev/urandom bs=100k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    echo "bandwidth = 0" > $SHUNIT_TMPDIR/limits
+    mpirun -n $RANKS $PCP -Lb 4M -Lm 1000 -Lf $SHUNIT_TMPDIR/limits $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    rm -f $SHUNIT_TMPDIR/limits
+}
+
+testprofile() {
+    RANKS=3
+    for X in `seq 1 10`  ; do
+	dd if=/dev/urandom bs=10k count=$X of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -c -P $SHUNIT_TMPDIR/profile $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    for R in `seq 0 $(($RANKS - 1))` ; do
+	assertTrue "No profile for rank $R" "[ -s $SHUNIT_TMPDIR/profile/pcp.$R.prof ]"
+    done
+    grep -q md5copy $SHUNIT_TMPDIR/profile/pcp.1.spans
+    assertEquals "No md5copy span" 0 $?
+    rm -rf $SHUNIT_TMPDIR/profile
+}
+
+testcheckpointrestore() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -b 1 -c -K $SHUNIT_TMPDIR/checkpoint -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "pcp failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/checkpoint
+    assertEquals "Verify from checkpoint failed" 0 $?
+    echo "corrupt" | dd of=$SHUNIT_TMPDIR/b/testfile1 conv=notrunc > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/checkpoint | grep -q "MD5FAIL.*testfile1"
+    assertEquals "Verify did not detect corruption" 0 $?
+    rm -f $SHUNIT_TMPDIR/checkpoint*
+}
+
 . /usr/bin/shunit2